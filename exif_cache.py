@@ -0,0 +1,62 @@
+"""
+Description: On-disk cache of per-clip metadata keyed by (path, mtime, size) so repeated runs over the same directory skip the metadata phase entirely
+"""
+
+from typing import Dict, List
+import json
+import os
+import os.path as osp
+import sqlite3
+
+cache_path = osp.join(osp.expanduser("~"), ".cache", "homevideomaker",
+                      "exif.sqlite")
+
+# SQLite caps the number of bound parameters per statement
+_select_chunk = 500
+
+
+def _connect() -> sqlite3.Connection:
+    os.makedirs(osp.dirname(cache_path), exist_ok=True)
+    conn = sqlite3.connect(cache_path)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS exif (path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, json BLOB)"
+    )
+    return conn
+
+
+def load(clips: List[str]) -> Dict[str, dict]:
+    """
+    Returns cached metadata for the subset of clips whose recorded (mtime, size) still match the file on disk. Clips absent from the result need a fresh metadata read.
+    """
+    abspaths = {osp.abspath(clip): clip for clip in clips}
+    cached = {}
+    with _connect() as conn:
+        paths = list(abspaths)
+        for i in range(0, len(paths), _select_chunk):
+            chunk = paths[i:i + _select_chunk]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT path, mtime, size, json FROM exif WHERE path IN ({placeholders})",
+                chunk)
+            for path, mtime, size, blob in rows:
+                clip = abspaths[path]
+                stat = os.stat(clip)
+                if stat.st_mtime_ns == mtime and stat.st_size == size:
+                    cached[clip] = json.loads(blob)
+    return cached
+
+
+def store(metadata: Dict[str, dict]) -> None:
+    """
+    Persists freshly read metadata, replacing any stale rows for the same paths
+    """
+    if not metadata:
+        return
+    with _connect() as conn:
+        rows = []
+        for clip, meta in metadata.items():
+            stat = os.stat(clip)
+            rows.append((osp.abspath(clip), stat.st_mtime_ns, stat.st_size,
+                         json.dumps(meta)))
+        conn.executemany("INSERT OR REPLACE INTO exif VALUES (?, ?, ?, ?)",
+                         rows)
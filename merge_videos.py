@@ -3,14 +3,21 @@ Author: Marc Eder
 Description: A tool to merge captured video clips into longer home movies with camcorder-style data/time overlays
 """
 
+import os
 import os.path as osp
 import argparse
-import glob
+import concurrent.futures
+import resource
+import shlex
+import subprocess
 import exiftool
+import exiftool.exceptions
+import exif_cache
+import quicktime
 from util import *
 
 # Currently accepts these types
-supported_input_types = (".mp4", ".mov", ".avi")
+supported_input_types = {".mp4", ".mov", ".avi"}
 
 # Keys to try in the EXIF data in order of precedence
 timestamp_keys = [
@@ -18,6 +25,14 @@ timestamp_keys = [
     "QuickTime:CreateDate"
 ]
 
+# The only tags we actually consume; restricting the exiftool request to these
+# keeps the JSON payload small
+exif_tags = timestamp_keys + [
+    "QuickTime:TimeZone", "QuickTime:ImageHeight", "QuickTime:ImageWidth",
+    "Composite:Rotation", "QuickTime:AudioFormat", "QuickTime:AudioChannels",
+    "Track*:AudioFormat"
+]
+
 
 def parse_arguments() -> argparse.Namespace:
     """
@@ -46,6 +61,13 @@ def parse_arguments() -> argparse.Namespace:
         default=1,
         help="Number of movies to merge these clips into",
     )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=max(1, os.cpu_count() // 2),
+        help="Number of ffmpeg processes to run concurrently when merging multiple parts",
+    )
     parser.add_argument("--no-date",
                         action="store_false",
                         default=True,
@@ -83,46 +105,96 @@ def main(args) -> None:
     overlay_clock = args.no_date  # Whether to overlay the clock on the image
     verbosity = args.verbosity  # FFMPEG verbosity level
 
-    # Get all files in the provided directory
-    files = glob.glob(osp.join(args.input_dir, "*"))
-
-    # Cull the files only to supported inputs
+    # Scan the provided directory, culling to supported inputs. os.scandir
+    # reuses the cached dirent type info, so no extra stat call per file.
     clips = []
-    for file in files:
-        ext = osp.splitext(file)[1]
-        if not ext.lower() in supported_input_types:
-            print(
-                f"`{osp.splitext(file)[1]}` file format not supported. `{file}` will be skipped!"
-            )
+    with os.scandir(args.input_dir) as it:
+        for entry in it:
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            ext = osp.splitext(entry.name)[1]
+            if not ext.lower() in supported_input_types:
+                print(
+                    f"`{ext}` file format not supported. `{entry.path}` will be skipped!"
+                )
+            else:
+                clips.append(entry.path)
+
+    # Check the on-disk cache first; only clips added or changed since the
+    # last run need their metadata re-read
+    exif_by_fname = exif_cache.load(clips)
+    cached_clips = set(exif_by_fname)
+
+    # Read QuickTime containers in-process via the moov atom parser; only
+    # .avi clips (and anything the parser can't handle) go through exiftool
+    need_exiftool = []
+    for clip in clips:
+        if clip in cached_clips:
+            continue
+        meta = None
+        if osp.splitext(clip)[1].lower() in quicktime_extensions:
+            meta = quicktime.parse_metadata(clip)
+        if meta is not None:
+            exif_by_fname[clip] = meta
         else:
-            clips.append(file)
+            need_exiftool.append(clip)
 
-    # Obtain the exif data for each video
-    movies = []
-    with exiftool.ExifTool() as exif:
-        for clip in clips:
-            # Get all the metadata
-            exif_data = exif.get_metadata(clip)
+    # Obtain the exif data for the remaining videos in a single batched
+    # exiftool call. One round-trip through the persistent exiftool process
+    # is far cheaper than one call per clip, and `-fast` stops exiftool
+    # scanning past the metadata block of each file.
+    if need_exiftool:
+        with exiftool.ExifTool(common_args=["-G", "-n", "-fast"]) as exif:
+            try:
+                exif_data_list = exif.execute_json(
+                    *[f"-{tag}" for tag in exif_tags], *need_exiftool)
+            except exiftool.exceptions.ExifToolOutputEmptyError:
+                # exiftool produced no JSON at all (every batched file was
+                # unreadable); the skip-with-warning path below handles it
+                exif_data_list = []
+        # Key results by each record's SourceFile; exiftool may omit records
+        # for files it can't read, and a positional zip would silently shift
+        # metadata onto the wrong clips
+        exif_by_fname.update(
+            {record["SourceFile"]: record
+             for record in exif_data_list})
 
-            # Extract date info from the metadata
-            date_info = get_date_info(exif_data, timestamp_keys)
+    # Persist the freshly read metadata for future runs. Clips with no
+    # record at all (unreadable files) are left out; they get skipped with a
+    # warning below.
+    exif_cache.store({
+        clip: exif_by_fname[clip]
+        for clip in clips
+        if clip not in cached_clips and clip in exif_by_fname
+    })
 
-            if date_info is None:
-                # If none of the keys are found, warn but add the video anyway
-                print(
-                    f"Failed to find creation timestamp key in EXIF data for video `{clip}`! No timestamp will be added and clip may be sorted out of order."
-                )
+    movies = []
+    for clip in clips:
+        exif_data = exif_by_fname.get(clip)
+        if exif_data is None:
+            print(
+                f"Failed to read metadata for video `{clip}`! It will be skipped."
+            )
+            continue
+        # Extract date info from the metadata
+        date_info = get_date_info(exif_data, timestamp_keys)
 
-            # Create a Movie recordtype and add it to the list
-            movies.append(
-                Movie(fname=clip,
-                      height=exif_data["QuickTime:ImageHeight"],
-                      width=exif_data["QuickTime:ImageWidth"],
-                      create_date=date_info,
-                      rotation=exif_data["Composite:Rotation"]))
+        if date_info is None:
+            # If none of the keys are found, warn but add the video anyway
+            print(
+                f"Failed to find creation timestamp key in EXIF data for video `{clip}`! No timestamp will be added and clip may be sorted out of order."
+            )
 
-    # Sort by creation date, ascending
-    movies.sort(key=lambda x: x.create_date)
+        # Create a Movie record and add it to the list
+        movies.append(
+            Movie(fname=clip,
+                  height=exif_data["QuickTime:ImageHeight"],
+                  width=exif_data["QuickTime:ImageWidth"],
+                  create_date=date_info,
+                  rotation=exif_data["Composite:Rotation"]))
+
+    # Sort by creation date, ascending (undated clips sort first)
+    movies.sort(key=lambda x: x._ts or 0)
 
     # Check for any duplicate timestamps, which may indicate redundant clips
     print("Checking for potential duplicate clips...........")
@@ -131,7 +203,7 @@ def main(args) -> None:
 
     # Check all clips have audio streams
     print("\nChecking that all clips have audio streams.........")
-    check_audio(movies)
+    check_audio(movies, exif_by_fname)
     print("Done!")
 
     # Confirm user wants to continue
@@ -149,26 +221,73 @@ def main(args) -> None:
         # How many clips to put in each merged movie
         step = len(movies) // num_parts
 
-        # For each movie to create
+        # Partition the temporally ordered movies and index the output files
+        movie_subsets = []
+        out_fnames = []
         for i in range(num_parts):
-            # Grab a subset of the temporally ordered movies
             start = i * step
             end = (i + 1) * step if i < num_parts - 1 else len(movies)
-            movies_subset = movies[start:end]
+            movie_subsets.append(movies[start:end])
 
-            # Add numerical index to output files
             filename, ext = osp.splitext(out_fname)
-            indexed_out_fname = f"{filename}{i}{ext}"
+            out_fnames.append(f"{filename}{i}{ext}")
 
-            # Build the concatenation command by parsing the movie info
-            concat_cmd = create_concat_cmd(movies_subset,
-                                           indexed_out_fname,
-                                           overlay_clock=overlay_clock,
-                                           verbosity=args.verbosity)
+        # Prefer a single ffmpeg process with one output per part, which
+        # shares process startup and decoder initialization across parts. A
+        # single process only works while every input fits under the open
+        # file descriptor limit (with headroom for ffmpeg's own files).
+        soft_nofile, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if len(movies) + 64 < soft_nofile:
+            concat_cmd = create_multi_concat_cmd(movie_subsets,
+                                                 out_fnames,
+                                                 overlay_clock=overlay_clock,
+                                                 verbosity=args.verbosity)
             if args.debug_cmd:
-                print(concat_cmd)
+                print(shlex.join(concat_cmd))
             run_cmd(concat_cmd)
 
+        else:
+            # Fall back to one ffmpeg job per part, run concurrently. Bound
+            # the parallelism and cap each ffmpeg's thread count so the
+            # concurrent encodes don't oversubscribe the machine.
+            jobs = min(args.jobs, num_parts)
+            threads_per_job = max(1, os.cpu_count() // jobs)
+
+            concat_cmds = []
+            for movies_subset, indexed_out_fname in zip(
+                    movie_subsets, out_fnames):
+                concat_cmd = create_concat_cmd(movies_subset,
+                                               indexed_out_fname,
+                                               overlay_clock=overlay_clock,
+                                               verbosity=args.verbosity,
+                                               threads=threads_per_job)
+                if args.debug_cmd:
+                    print(shlex.join(concat_cmd))
+                concat_cmds.append(concat_cmd)
+
+            # Capture each job's output so the interleaved logs stay readable
+            # when printed after completion. On failure, print the captured
+            # output before propagating: it holds the only ffmpeg diagnostics
+            # since the pipes were captured.
+            def run_job(cmd):
+                try:
+                    return run_cmd(cmd, capture_output=True)
+                except subprocess.CalledProcessError as err:
+                    if err.stdout:
+                        print(err.stdout.decode())
+                    if err.stderr:
+                        print(err.stderr.decode())
+                    raise
+
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=jobs) as pool:
+                results = list(pool.map(run_job, concat_cmds))
+            for result in results:
+                if result.stdout:
+                    print(result.stdout.decode())
+                if result.stderr:
+                    print(result.stderr.decode())
+
     else:
         # Build the concatenation command by parsing the movie info
         concat_cmd = create_concat_cmd(movies,
@@ -176,7 +295,7 @@ def main(args) -> None:
                                        overlay_clock=overlay_clock,
                                        verbosity=args.verbosity)
         if args.debug_cmd:
-            print(concat_cmd)
+            print(shlex.join(concat_cmd))
         run_cmd(concat_cmd)
 
     # Final note that merge worked successfully
@@ -0,0 +1,216 @@
+"""
+Description: Minimal QuickTime/MP4 `moov` atom reader. Pulls the handful of metadata fields this tool consumes (creation date, dimensions, rotation, audio format) with a few small seeks instead of shelling out to exiftool.
+"""
+
+from typing import Iterator, Optional, Tuple
+import datetime
+import math
+import struct
+
+# QuickTime timestamps count seconds since 1904-01-01 UTC
+qt_epoch = datetime.datetime(1904, 1, 1)
+
+
+def _read_atoms(f, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """
+    Iterates the atoms between `start` and `end`, yielding (name, body_start, body_end) for each one.
+    """
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        size, name = struct.unpack(">I4s", f.read(8))
+        header_size = 8
+        if size == 1:
+            # 64-bit atom; actual size follows the header
+            size = struct.unpack(">Q", f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            # Atom extends to the end of the enclosing scope
+            size = end - offset
+        if size < header_size:
+            break
+        yield name, offset + header_size, offset + size
+        offset += size
+
+
+def _fixed_16_16(raw: bytes) -> float:
+    """
+    Decodes a signed 16.16 fixed-point value
+    """
+    return struct.unpack(">i", raw)[0] / 65536
+
+
+def _parse_mvhd(f, start: int) -> Optional[datetime.datetime]:
+    """
+    Reads the movie creation time from the `mvhd` atom (None when unset)
+    """
+    f.seek(start)
+    data = f.read(12)
+    version = data[0]
+    if version == 1:
+        creation = struct.unpack(">Q", data[4:12])[0]
+    else:
+        creation = struct.unpack(">I", data[4:8])[0]
+    if creation == 0:
+        return None
+    return qt_epoch + datetime.timedelta(seconds=creation)
+
+
+def _parse_tkhd(f, start: int) -> Tuple[int, int, int]:
+    """
+    Reads (width, height, rotation) from the `tkhd` atom. Rotation is inferred from the transformation matrix.
+    """
+    f.seek(start)
+    data = f.read(96)
+    version = data[0]
+    # The matrix sits after the fixed-size header, which is larger for
+    # version 1 atoms (64-bit timestamps and duration)
+    matrix_offset = 52 if version == 1 else 40
+    a = _fixed_16_16(data[matrix_offset:matrix_offset + 4])
+    b = _fixed_16_16(data[matrix_offset + 4:matrix_offset + 8])
+    rotation = round(math.degrees(math.atan2(b, a))) % 360
+    width = struct.unpack(">I", data[matrix_offset + 36:matrix_offset +
+                                     40])[0] >> 16
+    height = struct.unpack(">I", data[matrix_offset + 40:matrix_offset +
+                                      44])[0] >> 16
+    return width, height, rotation
+
+
+def _parse_creationdate(value: str) -> Optional[str]:
+    """
+    Converts Apple's ISO 8601 creation date (e.g. `2020-01-02T18:30:00-0400`) to the exiftool-style string the rest of the pipeline parses
+    """
+    try:
+        date = datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z")
+    except ValueError:
+        return None
+    offset = date.strftime("%z")
+    return date.strftime("%Y:%m:%d %H:%M:%S") + offset[:3] + ":" + offset[3:]
+
+
+def _parse_meta(f, start: int, end: int, meta: dict) -> None:
+    """
+    Reads the Apple `keys`/`ilst` metadata from the `meta` atom, capturing the timezone-aware com.apple.quicktime.creationdate iPhones record
+    """
+    # QuickTime-style meta atoms hold child atoms directly; ISO-style ones
+    # prefix them with 4 bytes of version/flags
+    f.seek(start)
+    probe = f.read(12)
+    if len(probe) < 12:
+        return
+    if probe[4:8] not in (b"hdlr", b"keys", b"ilst"):
+        start += 4
+
+    # The keys atom maps 1-based indices to key names; ilst holds the values
+    # under atoms named by those indices
+    keys = {}
+    ilst = None
+    for name, s, e in _read_atoms(f, start, end):
+        if name == b"keys":
+            f.seek(s)
+            data = f.read(e - s)
+            count = struct.unpack(">I", data[4:8])[0]
+            offset = 8
+            for index in range(1, count + 1):
+                size = struct.unpack(">I", data[offset:offset + 4])[0]
+                keys[index] = data[offset + 8:offset + size]
+                offset += size
+        elif name == b"ilst":
+            ilst = (s, e)
+
+    if ilst is None:
+        return
+    for name, s, e in _read_atoms(f, *ilst):
+        index = struct.unpack(">I", name)[0]
+        if keys.get(index) != b"com.apple.quicktime.creationdate":
+            continue
+        for name2, s2, e2 in _read_atoms(f, s, e):
+            if name2 == b"data":
+                # type (4) + locale (4), then the UTF-8 value
+                f.seek(s2 + 8)
+                value = f.read(e2 - s2 - 8).decode("utf-8", "replace")
+                creation_date = _parse_creationdate(value)
+                if creation_date is not None:
+                    meta["QuickTime:CreationDate"] = creation_date
+
+
+def _parse_mdia(f, start: int, end: int) -> Tuple[Optional[bytes], Optional[str]]:
+    """
+    Reads the handler type (`vide`/`soun`) from a track's `mdia` atom, plus the sample format fourcc for audio tracks.
+    """
+    handler = None
+    sample_format = None
+    minf = None
+    for name, s, e in _read_atoms(f, start, end):
+        if name == b"hdlr":
+            # version/flags (4) + pre_defined (4), then the handler type
+            f.seek(s + 8)
+            handler = f.read(4)
+        elif name == b"minf":
+            minf = (s, e)
+
+    if handler == b"soun" and minf is not None:
+        for name, s, e in _read_atoms(f, *minf):
+            if name != b"stbl":
+                continue
+            for name2, s2, e2 in _read_atoms(f, s, e):
+                if name2 == b"stsd":
+                    # version/flags (4) + entry count (4) + entry size (4),
+                    # then the sample format fourcc
+                    f.seek(s2 + 12)
+                    sample_format = f.read(4).decode("ascii", "replace")
+
+    return handler, sample_format
+
+
+def _parse_trak(f, start: int, end: int, meta: dict) -> None:
+    """
+    Folds one `trak` atom's dimensions/rotation (video) or format (audio) into the metadata dict
+    """
+    tkhd = None
+    for name, s, e in _read_atoms(f, start, end):
+        if name == b"tkhd":
+            tkhd = _parse_tkhd(f, s)
+        elif name == b"mdia":
+            handler, sample_format = _parse_mdia(f, s, e)
+            if handler == b"vide" and tkhd is not None:
+                width, height, rotation = tkhd
+                if width and height:
+                    meta.setdefault("QuickTime:ImageWidth", width)
+                    meta.setdefault("QuickTime:ImageHeight", height)
+                    meta.setdefault("Composite:Rotation", rotation)
+            elif handler == b"soun":
+                meta.setdefault("QuickTime:AudioFormat", sample_format
+                                or "unknown")
+
+
+def parse_metadata(fname: str) -> Optional[dict]:
+    """
+    Parses the `moov` atom of a QuickTime/MP4 file and returns the metadata as a dict keyed by the same tag names exiftool reports. Returns None if the file can't be parsed (caller should fall back to exiftool).
+    """
+    meta = {}
+    try:
+        with open(fname, "rb") as f:
+            f.seek(0, 2)
+            file_end = f.tell()
+            for name, start, end in _read_atoms(f, 0, file_end):
+                if name != b"moov":
+                    continue
+                for name2, s, e in _read_atoms(f, start, end):
+                    if name2 == b"mvhd":
+                        create_date = _parse_mvhd(f, s)
+                        if create_date is not None:
+                            meta["QuickTime:CreateDate"] = \
+                                create_date.strftime("%Y:%m:%d %H:%M:%S")
+                    elif name2 == b"trak":
+                        _parse_trak(f, s, e, meta)
+                    elif name2 == b"meta":
+                        _parse_meta(f, s, e, meta)
+                break
+    except (OSError, struct.error, IndexError):
+        return None
+    # Without a video track's dimensions the caller can't build a Movie, so
+    # treat the file as unparseable and let exiftool have a shot at it
+    if "QuickTime:ImageWidth" not in meta:
+        return None
+    return meta
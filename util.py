@@ -1,34 +1,54 @@
-from typing import Tuple, List
+from typing import Optional, Tuple, List
+import concurrent.futures
+import os
+import os.path as osp
 import subprocess
 import datetime
-from recordtype import recordtype
+from dataclasses import dataclass
 
-# Movie type (essentially a mutable namedtuple)
-Movie = recordtype("Movie", "fname height width create_date rotation")
 
-
-def run_cmd(cmd: str, **kwargs) -> subprocess.CompletedProcess:
+@dataclass(slots=True, frozen=True)
+class Movie:
+    """
+    Record describing a single clip to be merged. Immutable after construction so records can safely be shared across concurrent command builders.
+    """
+    fname: str
+    height: int
+    width: int
+    create_date: Optional[datetime.datetime]
+    rotation: int
+    # Creation time in integer tenths of a second, precomputed once for
+    # sorting and duplicate detection (None when no date info was found)
+    _ts: Optional[int] = None
+
+    def __post_init__(self) -> None:
+        if self.create_date is not None:
+            object.__setattr__(self, "_ts",
+                               int(self.create_date.timestamp() * 10))
+
+# Camcorder-style timestamp overlay. Only the base timestamp and the x/y
+# anchors vary per clip, so everything else is baked into the template.
+drawtext_template = "drawtext=expansion=strftime: basetime={basetime}000000 : fontcolor=white : text='%^b %d, %Y%n%l\\:%M%p' : fontsize=36 : y={y}-4*lh : x={x}-text_w-2*max_glyph_w"
+
+
+def run_cmd(cmd: List[str], **kwargs) -> subprocess.CompletedProcess:
     """
     Simple wrapper around subprocess run
     """
-    return subprocess.run(cmd, shell=True, check=True, **kwargs)
+    return subprocess.run(cmd, check=True, **kwargs)
 
 
 def parse_datetime_with_tz(exif_date: str) -> datetime.datetime:
     """
-    Parses the date/time captured from the exif data, assuming timezone is already incorporated
+    Parses the date/time captured from the exif data, preserving any trailing timezone offset
     """
-    date, tod = (exif_date.split(" "))
-    tod = tod.split("-")[0]
-    yr, mo, day = date.split(":")
-    hour, minute, sec = tod.split(":")
+    # exiftool dates look like `2020:01:02 15:04:05-08:00`; swapping the
+    # first two colons for dashes yields an ISO 8601 string
     try:
-        d = datetime.date(int(yr), int(mo), int(day))
-        t = datetime.time(int(hour), int(minute), int(sec))
+        return datetime.datetime.fromisoformat(exif_date.replace(":", "-", 2))
     except ValueError:
         print("Invalid date/time information")
         return None
-    return datetime.datetime.combine(d, t)
 
 
 def get_date_info(exif_data: dict,
@@ -46,6 +66,11 @@ def get_date_info(exif_data: dict,
         timestamp_val = exif_data.get(timestamp_key)
         i += 1
 
+    # None of the keys were present (e.g. the muxer wrote a zeroed creation
+    # time); the caller warns about undated clips
+    if timestamp_val is None:
+        return None
+
     # If/else statements disambiguating how to parse each case
     date_info = None
     if timestamp_key in [
@@ -57,10 +82,12 @@ def get_date_info(exif_data: dict,
         # This class of tags has an additional tag to reference for the timezone. We can use the same function to get the UTC datetime
         date_info = parse_datetime_with_tz(timestamp_val)
 
-        # If there"s a time zone, adjust accordingly
-        if "QuickTime:TimeZone" in exif_data:
+        # If there"s a time zone, convert the UTC create date to it
+        if date_info is not None and "QuickTime:TimeZone" in exif_data:
             tz_offset = exif_data["QuickTime:TimeZone"]
-            date_info += datetime.timedelta(minutes=tz_offset)
+            date_info = date_info.replace(
+                tzinfo=datetime.timezone.utc).astimezone(
+                    datetime.timezone(datetime.timedelta(minutes=tz_offset)))
 
     # Returns date information (or None if not date info found)
     return date_info
@@ -70,162 +97,205 @@ def create_concat_cmd(movies: List[Movie],
                       out_fname: str,
                       max_dims: Tuple[int, int] = (1920, 1080),
                       overlay_clock: bool = True,
-                      verbosity: str = "quiet") -> str:
-    cmd = "ffmpeg \\\n"
-    cmd += "    -y \\\n"
-    cmd += f"    -loglevel {verbosity} \\\n"
-    cmd += "    -stats \\\n"
+                      verbosity: str = "quiet",
+                      threads: int = 0) -> List[str]:
+    cmd = ["ffmpeg", "-y", "-loglevel", verbosity, "-stats"]
 
     n = len(movies)
     for mov in movies:
-        cmd += f"    -i {mov.fname} \\\n"
+        cmd += ["-i", mov.fname]
 
-    # Create the string that pulls the relevant streams from the inputs. Assumes all inputs have 1 audio and 1 video stream
-    complex_filter_str = "\""
+    # Create the string that pulls the relevant streams from the inputs,
+    # collecting the pieces in a list so the join stays linear in the number
+    # of clips. Assumes all inputs have 1 audio and 1 video stream
+    filter_parts = []
     for i, mov in enumerate(movies):
         filter_str = create_filter_str(mov, max_dims, overlay_clock)
-        complex_filter_str += f"[{i}:v]{filter_str}[v{i}]; \\\n"
+        filter_parts.append(f"[{i}:v]{filter_str}[v{i}]; ")
 
     for i, mov in enumerate(movies):
-        complex_filter_str += f"[v{i}]"
-        complex_filter_str += f"[{i}:a]"
+        filter_parts.append(f"[v{i}]")
+        filter_parts.append(f"[{i}:a]")
 
-    # Finish the command string with the number of streams to join (n) and declare that there will always be 1 audio and 1 video output stream
-    complex_filter_str += f"concat=n={n}:v=1:a=1[v][a]\""
+    # Finish the filter string with the number of streams to join (n) and declare that there will always be 1 audio and 1 video output stream
+    filter_parts.append(f"concat=n={n}:v=1:a=1[v][a]")
 
-    cmd += f"    -filter_complex \\\n{complex_filter_str} \\\n"
+    cmd += ["-filter_complex", "".join(filter_parts)]
 
     # Map the concatenated streams to the output file
-    cmd += "    -map \"[v]\" \\\n"
-    cmd += "    -map \"[a]\" \\\n"
-    cmd += "    -vcodec libx264 \\\n"
-    cmd += "    -acodec aac \\\n"
+    cmd += ["-map", "[v]", "-map", "[a]", "-vcodec", "libx264", "-acodec", "aac"]
+
+    # Cap the thread count per process when running multiple jobs concurrently
+    if threads > 0:
+        cmd += ["-threads", str(threads)]
 
     # Add the output file
-    cmd += f"    {out_fname}"
+    cmd.append(out_fname)
 
     return cmd
 
 
-def swap_dims(movie: Movie) -> None:
+def create_multi_concat_cmd(movie_subsets: List[List[Movie]],
+                            out_fnames: List[str],
+                            max_dims: Tuple[int, int] = (1920, 1080),
+                            overlay_clock: bool = True,
+                            verbosity: str = "quiet") -> List[str]:
     """
-    Simply swaps the height and width attributes for a movie. Called with rotation is not 0.
+    Builds a single ffmpeg command that concatenates each subset of movies into its own output file. Listing every input once and fanning out to multiple outputs shares process startup and decoder initialization across the parts, rather than paying it once per part.
     """
-    tmp = movie.width
-    movie.width = movie.height
-    movie.height = tmp
+    cmd = ["ffmpeg", "-y", "-loglevel", verbosity, "-stats"]
+
+    for subset in movie_subsets:
+        for mov in subset:
+            cmd += ["-i", mov.fname]
+
+    # One filter chain per input stream, then one concat node per part. Input
+    # indices are global across the subsets since every input is listed once.
+    filter_parts = []
+    idx = 0
+    for p, subset in enumerate(movie_subsets):
+        start = idx
+        for mov in subset:
+            filter_str = create_filter_str(mov, max_dims, overlay_clock)
+            filter_parts.append(f"[{idx}:v]{filter_str}[v{idx}]; ")
+            idx += 1
+
+        for i in range(start, idx):
+            filter_parts.append(f"[v{i}]")
+            filter_parts.append(f"[{i}:a]")
+        filter_parts.append(
+            f"concat=n={len(subset)}:v=1:a=1[vout{p}][aout{p}]; ")
+
+    cmd += ["-filter_complex", "".join(filter_parts).rstrip("; ")]
+
+    # Map each part's concatenated streams to its own output file
+    for p, out_fname in enumerate(out_fnames):
+        cmd += [
+            "-map", f"[vout{p}]", "-map", f"[aout{p}]", "-vcodec", "libx264",
+            "-acodec", "aac", out_fname
+        ]
+
+    return cmd
 
 
 def create_filter_str(movie: Movie,
                       max_dims: Tuple[int, int],
                       overlay_clock: bool = True) -> str:
-    # Open filter string
-    filter_str = "setpts=PTS-STARTPTS, "
+    # Work on local copies of the dimensions so building a command never
+    # mutates the Movie record; repeated or concurrent calls would otherwise
+    # see half-adjusted state
+    width, height = movie.width, movie.height
+
+    # Collect the filter stages, joined at the end
+    filter_parts = ["setpts=PTS-STARTPTS"]
 
     # Match dimensions to rotated content
-    if movie.rotation != 0:
-        if movie.rotation == 90:
-            swap_dims(movie)
-            movie.rotation = 0
-        elif movie.rotation == 270:
-            swap_dims(movie)
-            movie.rotation = 0
+    if movie.rotation in (90, 270):
+        width, height = height, width
 
     # Scale to the max dims (assume the input images are no worse than 1280 x 720). Warn if video dimensions below that.
-    if ((movie.width > movie.height) and
-        ((movie.width < 1280) or
-         (movie.height < 720))) or ((movie.width <= movie.height) and
-                                    ((movie.height < 1280) or
-                                     (movie.width < 720))):
+    if ((width > height) and
+        ((width < 1280) or (height < 720))) or ((width <= height) and
+                                                ((height < 1280) or
+                                                 (width < 720))):
         print(
             f"`{movie.fname}` is less than (1280x720) resolution. Results may look pixelated."
         )
 
-    # Do nothing when:
-    # * both dimensions are correct
-    # * one dimension is correct and the other is smaller
-    scale = False
-    # Case 1: Downscale height, adjust width accordingly (will pad)
-    if (movie.width < max_dims[0]) and (movie.height > max_dims[1]):
-        height_ratio = movie.height / max_dims[1]
-        movie.height = max_dims[1]
-        movie.width = int(movie.width / height_ratio)
-        scale = True
-    # Case 2: Downscale width, adjust height accordingly (will pad)
-    elif (movie.width > max_dims[0]) and (movie.height < max_dims[1]):
-        width_ratio = movie.width / max_dims[0]
-        movie.width = max_dims[0]
-        movie.height = int(movie.height / width_ratio)
-        scale = True
-    # Case 3: Upscale
-    elif (movie.width < max_dims[0]) and (movie.height < max_dims[1]):
-        width_ratio = movie.width / max_dims[0]
-        height_ratio = movie.height / max_dims[1]
-        # Upscale based on width
-        if width_ratio >= height_ratio:
-            movie.width = max_dims[0]
-            movie.height = int(movie.height / width_ratio)
-            scale = True
-        # Upscale based on height
-        else:
-            movie.height = max_dims[1]
-            movie.width = int(movie.width / height_ratio)
-            scale = True
-    # Case 4: Downscale
-    elif (movie.width > max_dims[0]) and (movie.height > max_dims[1]):
-        width_ratio = movie.width / max_dims[0]
-        height_ratio = movie.height / max_dims[1]
-        # Downscale based on width
-        if width_ratio >= height_ratio:
-            movie.width = max_dims[0]
-            movie.height = int(movie.height / width_ratio)
-            scale = True
-        # Downscale based on height
-        else:
-            movie.height = max_dims[1]
-            movie.width = int(movie.width / height_ratio)
-            scale = True
+    # Rescale (up or down) so the dimension closest to its target exactly
+    # fits the box, preserving aspect ratio; the other dimension is padded
+    # below. A ratio of 1 means the clip already fits exactly.
+    ratio = max(width / max_dims[0], height / max_dims[1])
+    new_width = round(width / ratio)
+    new_height = round(height / ratio)
 
     # Add the rescale filter
-    if scale:
-        filter_str += f"scale={movie.width}:{movie.height}, "
+    if (new_width, new_height) != (width, height):
+        filter_parts.append(f"scale={new_width}:{new_height}")
+    width, height = new_width, new_height
 
     # Pad the videos to make them all same size
-    if (movie.width < max_dims[0]) or (movie.height < max_dims[1]):
-        filter_str += f"pad=width={max_dims[0]}:height={max_dims[1]}:x={(max_dims[0] - movie.width) // 2}:y={(max_dims[1] - movie.height) // 2}:color=black, "
+    if (width < max_dims[0]) or (height < max_dims[1]):
+        filter_parts.append(
+            f"pad=width={max_dims[0]}:height={max_dims[1]}:x={(max_dims[0] - width) // 2}:y={(max_dims[1] - height) // 2}:color=black"
+        )
 
-    filter_str += "setsar=1"
+    filter_parts.append("setsar=1")
 
-    # Overlay the clock
+    # Overlay the clock. The epoch seconds are computed here rather than via
+    # a `date` command substitution so no shell subprocess runs per clip.
+    # drawtext's strftime formats in the rendering machine's local time, so
+    # feed it the clip's wall-clock time (timezone stripped) to keep the
+    # overlay showing the time the clip was shot regardless of where it is
+    # encoded.
     if movie.create_date is not None and overlay_clock:
-        filter_str += f", drawtext=expansion=strftime: basetime=$(date +%s -d\'{movie.create_date.date()} {movie.create_date.time()}\')000000 : fontcolor=white : text=\'%^b %d, %Y%n%l\\\\:%M%p\' : fontsize=36 : y={movie.height}-4*lh : x={movie.width + (max_dims[0] - movie.width) // 2}-text_w-2*max_glyph_w"
+        filter_parts.append(
+            drawtext_template.format(
+                basetime=int(
+                    movie.create_date.replace(tzinfo=None).timestamp()),
+                y=height,
+                x=width + (max_dims[0] - width) // 2))
 
-    return filter_str
+    return ", ".join(filter_parts)
 
 
 def duplicate_check(movies: List[Movie]) -> None:
     """
-    Warns user of possible duplicate clips when multiple clips have the same exact timestamp (to the tenth of a second).
+    Warns user of possible duplicate clips when multiple clips have the same exact timestamp (to the tenth of a second). Clips without date info are skipped.
     """
     unique_time = {}
     for m in movies:
-        if m.create_date.timestamp() not in unique_time:
-            unique_time[m.create_date.timestamp()] = m
+        if m._ts is None:
+            continue
+        if m._ts not in unique_time:
+            unique_time[m._ts] = m
         else:
             print(
-                f"ALERT: Possible duplicate video found: {m.fname} and {unique_time[m.create_date.timestamp()].fname} share the same timestamp!"
+                f"ALERT: Possible duplicate video found: {m.fname} and {unique_time[m._ts].fname} share the same timestamp!"
             )
 
 
-def check_audio(movies: List[Movie]) -> None:
+# QuickTime containers (.mp4/.mov) expose their audio tracks through the exif
+# tags; other containers need an ffprobe fallback
+quicktime_extensions = (".mp4", ".mov")
+
+
+def check_audio(movies: List[Movie], exif_by_fname: dict) -> None:
     """
-    Calls ffprobe on each clip to confirm that there is an audio stream. If one doesn't exist, alerts the user.
+    Confirms that each clip has an audio stream using the already-fetched exif data, falling back to ffprobe for containers exiftool can't introspect. If no audio stream exists, alerts the user.
     """
+
+    def _has_audio_tag(exif_data: dict) -> bool:
+        return any("AudioFormat" in key or "AudioChannels" in key
+                   for key in exif_data)
+
+    def _probe(m: Movie) -> Tuple[str, bool]:
+        output = run_cmd([
+            "ffprobe", "-i", m.fname, "-show_streams", "-select_streams", "a",
+            "-loglevel", "error"
+        ],
+                         capture_output=True)
+        return m.fname, bool(output.stdout)
+
+    # Answer the check from the exif data where possible; only non-QuickTime
+    # clips still need an ffprobe subprocess
+    results = []
+    need_probe = []
     for m in movies:
-        output = run_cmd(
-            f"ffprobe -i {m.fname} -show_streams -select_streams a -loglevel error",
-            capture_output=True)
-        if not output.stdout:
+        if osp.splitext(m.fname)[1].lower() in quicktime_extensions:
+            results.append((m.fname, _has_audio_tag(exif_by_fname[m.fname])))
+        else:
+            need_probe.append(m)
+
+    # The probes are independent subprocess spawns, so run them concurrently
+    # and report the results serially to keep the output deterministic
+    if need_probe:
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=os.cpu_count()) as pool:
+            results.extend(pool.map(_probe, need_probe))
+
+    for fname, has_audio in results:
+        if not has_audio:
             print(
-                f"ALERT: Video missing audio stream! Merging will fail! ({m.fname})"
+                f"ALERT: Video missing audio stream! Merging will fail! ({fname})"
             )
\ No newline at end of file